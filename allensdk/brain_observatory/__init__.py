@@ -62,7 +62,7 @@ def dict_to_indexed_array(dc, order=None):
 
         if isinstance(dc[key], (np.ndarray, list)):
             extended = dc[key]
-        if isinstance(dc[key], Iterable):
+        elif isinstance(dc[key], Iterable):
             extended = [x for x in dc[key]]
         else:
             extended = [dc[key]]
@@ -1,7 +1,11 @@
-from typing import Any, Dict, List, Optional, Tuple, Type
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+from urllib.parse import urlparse
 
+import h5py
 import numpy as np
 import pandas as pd
+import pynwb
 from allensdk.brain_observatory import sync_utilities
 from allensdk.brain_observatory.behavior.behavior_session import (
     BehaviorSession,
@@ -319,6 +323,7 @@ class BehaviorEcephysSession(VBNBehaviorSession):
         )
         self._probes = probes
         self._optotagging_table = optotagging_table
+        self._probes_table: Optional[pd.DataFrame] = None
 
     @property
     def probes(self) -> pd.DataFrame:
@@ -332,7 +337,12 @@ class BehaviorEcephysSession(VBNBehaviorSession):
             - lfp_sampling_rate: LFP sampling rate
             - has_lfp_data: Whether this probe has LFP data
         """
-        return self._probes.to_dataframe()
+        # Built once and reused; reset by `get_lfp` since loading LFP can
+        # change lfp_sampling_rate. A copy is returned so that callers
+        # cannot modify the cached table
+        if self._probes_table is None:
+            self._probes_table = self._probes.to_dataframe()
+        return self._probes_table.copy()
 
     @property
     def optotagging_table(self) -> pd.DataFrame:
@@ -352,11 +362,11 @@ class BehaviorEcephysSession(VBNBehaviorSession):
 
     @property
     def metadata(self) -> dict:
-        behavior_meta = super()._get_metadata(behavior_metadata=self._metadata)
-        ecephys_meta = {
-            "ecephys_session_id": self._metadata.ecephys_session_id
-        }
-        return {**behavior_meta, **ecephys_meta}
+        # _get_metadata builds a new dict on every call, so it is safe to
+        # extend in place
+        metadata = super()._get_metadata(behavior_metadata=self._metadata)
+        metadata["ecephys_session_id"] = self._metadata.ecephys_session_id
+        return metadata
 
     @property
     def mean_waveforms(self) -> Dict[int, np.ndarray]:
@@ -454,6 +464,7 @@ class BehaviorEcephysSession(VBNBehaviorSession):
         Get LFP data for a single probe given by `probe_id`
         """
         probe = self._get_probe(probe_id=probe_id)
+        self._probes_table = None
         return probe.lfp
 
     def get_current_source_density(self, probe_id: int) -> Optional[DataArray]:
@@ -571,6 +582,60 @@ class BehaviorEcephysSession(VBNBehaviorSession):
             metadata=BehaviorEcephysMetadata.from_nwb(nwbfile=nwbfile),
         )
 
+    @classmethod
+    def open_nwb(
+        cls,
+        path_or_url: Union[str, Path],
+        chunk_cache_mb: int = 256,
+        **kwargs,
+    ) -> "BehaviorEcephysSession":
+        """
+        Reads a `BehaviorEcephysSession` from a local NWB file or a URL,
+        with a larger HDF5 chunk cache than the 1 MB default so that
+        repeated reads within the same chunk are not re-read from disk.
+
+        Parameters
+        ----------
+        path_or_url
+            Path to the nwb file, or an http(s) URL. URLs are streamed with
+            `remfile`, which must be installed.
+        chunk_cache_mb
+            Size of the HDF5 raw data chunk cache in MB
+        kwargs: kwargs sent to `from_nwb`
+
+        Returns
+        -------
+        instantiated `BehaviorEcephysSession`
+        """
+        path_or_url = str(path_or_url)
+        remote_file = None
+        if urlparse(path_or_url).scheme in ("http", "https"):
+            try:
+                import remfile
+            except ModuleNotFoundError as e:
+                raise ModuleNotFoundError(
+                    "remfile must be installed to open an nwb file from a "
+                    f"URL: {path_or_url}"
+                ) from e
+            remote_file = remfile.File(path_or_url)
+
+        try:
+            with h5py.File(
+                remote_file if remote_file is not None else path_or_url,
+                "r",
+                rdcc_nbytes=chunk_cache_mb * 1024**2,
+                rdcc_nslots=50000,
+                rdcc_w0=0.5,
+            ) as h5_file:
+                with pynwb.NWBHDF5IO(
+                    file=h5_file, mode="r", load_namespaces=True
+                ) as read_io:
+                    nwbfile = read_io.read()
+                    return cls.from_nwb(nwbfile=nwbfile, **kwargs)
+        finally:
+            if remote_file is not None:
+                remote_file.close()
+
     def _get_identifier(self) -> str:
         return str(self._metadata.ecephys_session_id)
 
@@ -5,7 +5,7 @@ import numpy.fft as npft
 # TODO: normalize function call names
 # TODO: document functions
 
-def create_basis_IPSP(neye,ncos,kpeaks,ks,DTsim,t0,I_stim,nkt,flag_exp,npcut):
+def create_basis_IPSP(neye,ncos,kpeaks,ks,DTsim,t0,I_stim,nkt,flag_exp,npcut,out=None):
     
     kbasprs = {}
     kbasprs['neye'] = neye #No of 'identity' basis vectors near time of spike
@@ -18,17 +18,14 @@ def create_basis_IPSP(neye,ncos,kpeaks,ks,DTsim,t0,I_stim,nkt,flag_exp,npcut):
     
     #Create spike-stim with which to convolve post spike filter
     spike_stim = np.zeros(np.shape(I_stim))
-    for kk in range(len(t0)):
-        spind = int(t0[kk])
-        #print int(t0[kk]), spind-190000
-        spike_stim[spind]=1.0
+    spike_stim[np.asarray(t0, dtype=np.int64)] = 1.0
     
-    ##Convolve temporal basis functions with spike-stim
-    c = np.zeros((len(spike_stim),ncos))
+    ##Convolve temporal basis functions with spike-stim (into out if an array of shape (len(I_stim), ncos) is given)
+    c = np.zeros((len(spike_stim),ncos)) if out is None else out
     for jj in range(ncos):
         basisfilt = gg0['ktbas'][:,jj]
         bconv = np.convolve(spike_stim,np.flipud(basisfilt),'full')
-        c[:,jj] = bconv[range(len(spike_stim))]        
+        c[:,jj] = bconv[:len(spike_stim)]
     
     basis_IPSP = c;
     
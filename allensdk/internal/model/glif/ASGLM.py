@@ -1,12 +1,224 @@
 import numpy as np
-import itertools
 import allensdk.internal.model.GLM as GLM
 import logging
-import statsmodels.api as sm
-import matplotlib.pyplot as plt
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    Parallel = None
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _sweep_design_matrix(basis_IPSP, start, pair_inds, keep, v_spike_deleted, ncos, inv_cinit, inv_tauinit, vL):
+    '''Design matrix of the afterspike current GLM for one sweep: the basis IPSPs of the pair over capacitance and
+    the leak over the membrane time constant, at the time steps that are not cut after a spike
+    '''
+    b_ipsp_spikes_deleted = basis_IPSP[start:start+len(keep)][np.ix_(keep, pair_inds)]
+
+    inp = np.empty((len(v_spike_deleted),ncos+1))
+    np.multiply(b_ipsp_spikes_deleted, inv_cinit, out=inp[:,:ncos])
+    if ne is not None:
+        inp[:,ncos] = ne.evaluate('(vL - v_spike_deleted)*inv_tauinit')
+    else:
+        np.subtract(vL, v_spike_deleted, out=inp[:,ncos])
+        inp[:,ncos] *= inv_tauinit
+    return inp
+
+
+def _sweep_normal_equations_numpy(basis_IPSP, start, pair_inds, keep, v_spike_deleted, out, ncos, inv_cinit, inv_tauinit, vL):
+    '''Accumulate the normal equations of the afterspike current GLM for one sweep
+    Parameters
+    ----------
+        basis_IPSP: array
+            basis IPSPs of every k for all sweeps, indexed [time, k]
+        start: int
+            row of basis_IPSP of the first time step of the sweep that is fit
+        pair_inds: array
+            indices of the k's of the pair in the columns of basis_IPSP
+        keep: array
+            boolean mask of the time steps of the sweep that are not cut after a spike
+        v_spike_deleted: array
+            voltage of the sweep with the spikes cut out
+        out: array
+            derivative of voltage minus injected current over capacitance with the spikes cut out
+    Returns
+    -------
+        XtX: array
+            design matrix transposed times itself
+        Xty: array
+            design matrix transposed times the output
+        n: int
+            number of time steps in the fit
+    '''
+    inp = _sweep_design_matrix(basis_IPSP, start, pair_inds, keep, v_spike_deleted, ncos, inv_cinit, inv_tauinit, vL)
+    return inp.T.dot(inp), inp.T.dot(out), out.size
+
+
+def _sweep_rss_numpy(basis_IPSP, start, pair_inds, keep, v_spike_deleted, out, ncos, inv_cinit, inv_tauinit, vL,
+                     fitprs):
+    '''Residual sum of squares of the afterspike current GLM for one sweep given the fit parameters fitprs'''
+    inp = _sweep_design_matrix(basis_IPSP, start, pair_inds, keep, v_spike_deleted, ncos, inv_cinit, inv_tauinit, vL)
+    resid = out - inp.dot(fitprs)
+    return resid.dot(resid)
+
+
+def _sweep_normal_equations_loop(basis_IPSP, start, pair_inds, keep, v_spike_deleted, out, ncos, inv_cinit, inv_tauinit, vL):
+    '''Same as _sweep_normal_equations_numpy, written as loops to be compiled with numba'''
+    # single pass over the sweep that builds each row of the design matrix in registers
+    XtX = np.zeros((ncos+1, ncos+1))
+    Xty = np.zeros(ncos+1)
+    x = np.empty(ncos+1)
+    n = 0
+    for kk in range(keep.size):
+        if not keep[kk]:
+            continue
+        for jj in range(ncos):
+            x[jj] = basis_IPSP[start+kk, pair_inds[jj]]*inv_cinit
+        x[ncos] = (vL - v_spike_deleted[n])*inv_tauinit
+        y = out[n]
+        for aa in range(ncos+1):
+            Xty[aa] += x[aa]*y
+            for bb in range(ncos+1):
+                XtX[aa, bb] += x[aa]*x[bb]
+        n += 1
+    return XtX, Xty, n
+
+
+def _sweep_rss_loop(basis_IPSP, start, pair_inds, keep, v_spike_deleted, out, ncos, inv_cinit, inv_tauinit, vL,
+                    fitprs):
+    '''Same as _sweep_rss_numpy, written as loops to be compiled with numba'''
+    rss = 0.0
+    n = 0
+    for kk in range(keep.size):
+        if not keep[kk]:
+            continue
+        resid = out[n] - (vL - v_spike_deleted[n])*inv_tauinit*fitprs[ncos]
+        for jj in range(ncos):
+            resid -= basis_IPSP[start+kk, pair_inds[jj]]*inv_cinit*fitprs[jj]
+        rss += resid*resid
+        n += 1
+    return rss
+
+
+_sweep_normal_equations = (njit(cache=True, fastmath=True)(_sweep_normal_equations_loop) if njit is not None
+                           else _sweep_normal_equations_numpy)
+_sweep_rss = njit(cache=True, fastmath=True)(_sweep_rss_loop) if njit is not None else _sweep_rss_numpy
+
+
+def _post_spike_keep_mask(n_t, t0, npcut):
+    '''Boolean mask of the n_t time steps of a sweep that are not within npcut points after a spike at the indices
+    t0. Overlapping windows are cut once, and windows that run past the end of the sweep are truncated
+    '''
+    keep = np.ones(n_t, dtype=bool)
+    delpts = (t0[:, None] + np.arange(npcut)[None, :]).ravel()
+    delpts = delpts[(delpts >= 0) & (delpts < n_t)]
+    keep[delpts] = False
+    return keep
+
+
+def _solve_asc_and_R(XtX, Xty, n, sweep_args, ncos, cinit, tauinit):
+    '''Fit the amplitudes of the afterspike currents and the resistance from the normal equations
+    Parameters
+    ----------
+        XtX, Xty, n:
+            normal equations of the fit summed over the sweeps in sweep_args
+        sweep_args: list of tuples
+            arguments of _sweep_normal_equations of each sweep in the fit, used to compute the residuals
+    Returns
+    -------
+        fit_R: float
+        fit_asc_amp: array
+        llh: float
+    '''
+    try:
+        #Gaussian GLM with identity link is ordinary least squares: solve the normal equations directly
+        fitprs = np.linalg.solve(XtX, Xty)  #fitprs has [AMP OF ASC, TAU]
+
+        #log-likelihood of the fit using the maximum likelihood estimate of the noise variance. The residuals are
+        #summed in a second pass over the data since yty - fitprs.dot(Xty) cancels catastrophically for good fits
+        rss = sum(_sweep_rss(*args, fitprs) for args in sweep_args)
+        sigma2 = rss/n
+        llh = -0.5*n*(np.log(2*np.pi*sigma2)+1)
+        fit_R=tauinit/(fitprs[ncos]*cinit)
+        fit_asc_amp=fitprs[:ncos]
+    except np.linalg.LinAlgError as e:
+        logging.warning("fit didn't work: " + str(e))
+        llh=np.nan
+        fit_R=np.nan
+        fit_asc_amp=np.ones(ncos)*np.nan
+
+    return fit_R, fit_asc_amp, llh
+
+
+def _fit_ks_pair(basis_IPSP, sweep_offsets, pair_inds, keep_list, v_all_swps_list, out_all_swps_list, tst, ncos,
+                 cinit, tauinit, vL, joint=False):
+    '''Fit the amplitudes of the afterspike currents and the resistance of each sweep for one pair of k's
+    Parameters
+    ----------
+        basis_IPSP: array
+            basis IPSPs of every k for all sweeps stored back to back, indexed [time, k]
+        sweep_offsets: array
+            sweep ss occupies rows sweep_offsets[ss]:sweep_offsets[ss+1] of basis_IPSP
+        pair_inds: array
+            indices of the k's of the pair in the columns of basis_IPSP
+        keep_list: list of arrays
+            boolean masks of the time steps of each sweep that are not cut after a spike
+        v_all_swps_list: list of arrays
+            voltage of each sweep with the spikes cut out
+        out_all_swps_list: list of arrays
+            derivative of voltage minus injected current over capacitance of each sweep with the spikes cut out
+        tst: int
+            time step to start
+        ncos: int
+            number of bases
+        cinit: float
+            membrane capacitance
+        tauinit: float
+            time constant of membrane
+        vL: float
+            resting potential
+        joint: bool
+            if True the sweeps are concatenated and fit once, and the returned lists hold that single fit
+    Returns
+    -------
+        R_for_each_sweep: list of floats
+        asc_amp_for_each_sweep: list of arrays
+        llh_for_each_sweep: list of floats
+    '''
+    inv_cinit = 1.0/cinit
+    inv_tauinit = 1.0/tauinit
+
+    sweep_args = [(basis_IPSP, offset+tst, pair_inds, keep, v_spike_deleted, out, ncos, inv_cinit, inv_tauinit, vL)
+                  for offset, keep, v_spike_deleted, out in
+                  zip(sweep_offsets, keep_list, v_all_swps_list, out_all_swps_list)]
+    normal_equations = [_sweep_normal_equations(*args) for args in sweep_args]
+    if joint:
+        #the normal equations of the concatenated sweeps are the sums over the sweeps
+        normal_equations = [tuple(sum(terms) for terms in zip(*normal_equations))]
+        fit_sweep_args = [sweep_args]
+    else:
+        fit_sweep_args = [[args] for args in sweep_args]
+
+    R_for_each_sweep=[]
+    asc_amp_for_each_sweep=[]
+    llh_for_each_sweep=[]
+    for (XtX, Xty, n), args in zip(normal_equations, fit_sweep_args):
+        fit_R, fit_asc_amp, llh = _solve_asc_and_R(XtX, Xty, n, args, ncos, cinit, tauinit)
+        R_for_each_sweep.append(fit_R)
+        asc_amp_for_each_sweep.append(fit_asc_amp)
+        llh_for_each_sweep.append(llh)
+
+    return R_for_each_sweep, asc_amp_for_each_sweep, llh_for_each_sweep
+
 
 def ASGLM_pairwise(ks_int, I_stim, voltage, spike_ind, cinit, tauinit, SCL, dt, resting_potential, 
-                   SHORT_RUN=False, MAKE_PLOT=False, SHOW_PLOT=False, BLOCK=False):
+                   SHORT_RUN=False, MAKE_PLOT=False, SHOW_PLOT=False, BLOCK=False, n_jobs=1, joint=False):
     '''Calculate the resistance and amplitude of the afterspike currents for 
     Parameters
     ----------
@@ -26,6 +238,12 @@ def ASGLM_pairwise(ks_int, I_stim, voltage, spike_ind, cinit, tauinit, SCL, dt,
             number of indicies that should be cut after a spike
         dt: float 
             size of time step of injected current
+        n_jobs: int
+            number of processes used to fit the ks pairs in parallel (1 fits them serially, -1 uses all cores). The
+            pair fits are cheap next to building the basis IPSPs, so a process pool rarely pays off
+        joint: bool
+            if True all sweeps are concatenated and fit jointly, so a single R, asc amplitude and llh is returned
+            for the best pair instead of one per sweep
         Returns
         '''
 
@@ -41,25 +259,30 @@ def ASGLM_pairwise(ks_int, I_stim, voltage, spike_ind, cinit, tauinit, SCL, dt,
     ncos = 2                    #no of bases!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
     flag_exp = 1                #flag_exp = 1 means use exponential bases, else use raised-cosine bumps 
     vL = resting_potential
+    inv_cinit = 1.0/cinit
+    inv_dt = 1.0/dt
     
     # GLM fit with post-spike currents
     tst = 0 #190000#355000    #time-step to start
     npcut = int(SCL)  # no of points to cut after each spike-initiation
     
+    # make sure the sweeps are contiguous arrays so slicing below creates views
+    I_stim = [np.ascontiguousarray(x, dtype=np.float64) for x in I_stim]
+    voltage = [np.ascontiguousarray(x, dtype=np.float64) for x in voltage]
+    spike_ind = [np.asarray(x, dtype=np.int64) for x in spike_ind]
+
     # Collect spikes between tst and tend  
     t0_list = []
     for mm in range(len(I_stim)):
         tend = len(I_stim[mm])
-        t0=[]
-        for jj in range(len(spike_ind[mm])):  
-            if spike_ind[mm][jj]>tst and spike_ind[mm][jj]<tend:
-                t0.append(spike_ind[mm][jj])
-        
-        t0_list.append(t0)
+        s = spike_ind[mm]
+        t0_list.append(s[(s > tst) & (s < tend)])
     
-    #Create a list of pairs of ks 
-    ks_pairs = list(itertools.combinations(ks_list,ncos)) 
-    ks_pairs_in_SI_units= list(itertools.combinations(ks_int, ncos))   
+    #Create an array of pairs of ks (one pair per row) from the index pairs into ks_list
+    ii, jj = np.triu_indices(len(ks_list), k=1)
+    ks_pair_inds = np.column_stack([ii, jj])
+    ks_pairs = np.asarray(ks_list)[ks_pair_inds]
+    ks_pairs_in_SI_units = np.asarray(ks_int)[ks_pair_inds]
     if len(ks_pairs)!=10:
         raise Exception('figure subplots will need to be changed as there is a different number than 10 ks_pairs.')
     
@@ -70,35 +293,83 @@ def ASGLM_pairwise(ks_int, I_stim, voltage, spike_ind, cinit, tauinit, SCL, dt,
     #Iterate over all pairs
     if SHORT_RUN:
         logging.warning("You are not doing all the ks pairs in ASGLM_pairwise")
-        ks_pairs=[ks_pairs[0]]
+        ks_pairs=ks_pairs[:1]
+        ks_pair_inds=ks_pair_inds[:1]
+        ks_pairs_in_SI_units=ks_pairs_in_SI_units[:1]
+
+    #each basis column depends only on the sweep and a single k, so compute it once and reuse it across pairs.
+    #The columns of all sweeps are stored back to back in one array indexed [time, k]; sweep rr occupies rows
+    #sweep_offsets[rr]:sweep_offsets[rr+1]
+    sweep_offsets = np.concatenate(([0], np.cumsum([len(x) for x in I_stim])))
+    basis_IPSP = np.zeros((sweep_offsets[-1], len(ks_list)))
+    for kk in np.unique(ks_pair_inds):
+        for rr in range(len(I_stim)):
+            GLM.create_basis_IPSP(neye,1,taus_filter,[ks_list[kk]],DTsim,t0_list[rr],I_stim[rr],nkt,flag_exp,npcut,
+                                  out=basis_IPSP[sweep_offsets[rr]:sweep_offsets[rr+1], kk:kk+1])
+
+    # cut spikes out of v and i, form the GLM output and put the different sweeps in lists (these do not depend on the ks pair)
+    keep_list = []
+    v_all_swps_list = []
+    out_all_swps_list = []
+    for ss in range(len(I_stim)): #loop over repeats
+        tend = len(I_stim[ss])
+        i = I_stim[ss][tst:tend-1]
+        
+        v = voltage[ss][tst:tend-1]    
+        vs = voltage[ss][tst+1:tend]
+        
+        #delete npcut points after spike from each qty using a single boolean mask
+        keep = _post_spike_keep_mask(tend-tst-1, t0_list[ss]-tst, npcut)
+
+        vs = vs[keep]
+        v = v[keep]
+        i = i[keep]
+
+        #derivative of voltage minus injected current, fused into a single pass when numexpr is available
+        if ne is not None:
+            out = ne.evaluate('(vs - v)*inv_dt - i*inv_cinit')
+        else:
+            out = (vs-v)*inv_dt - i*inv_cinit#+ (v-vL)/tauinit - i/cinit
+        
+        keep_list.append(keep)
+        v_all_swps_list.append(v)
+        out_all_swps_list.append(out)
+
+    # Compute amplitude each basis AS current using a GLM; the ks pairs are independent so fit them in parallel
+    fit_args = ((basis_IPSP, sweep_offsets, pair_inds, keep_list, v_all_swps_list, out_all_swps_list,
+                 tst, ncos, cinit, tauinit, vL, joint) for pair_inds in ks_pair_inds)
+    if Parallel is not None and n_jobs != 1 and len(ks_pairs) > 1:
+        results = Parallel(n_jobs=n_jobs, backend='loky')(delayed(_fit_ks_pair)(*args) for args in fit_args)
+    else:
+        results = [_fit_ks_pair(*args) for args in fit_args]
+
+    if MAKE_PLOT or SHOW_PLOT:
+        #pyplot is slow to import and is not needed by the fit itself
+        import matplotlib.pyplot as plt
 
     R_for_all_ks_pairs=[]
     asc_amp_for_all_ks_pairs=[]
     El_for_all_ks_pairs=[] 
     C_for_all_ks_pairs=[]
     llh_for_all_ks_pairs=[]
-    for ks_ind, (ks_fit_units, ks_SI_units) in enumerate(zip(ks_pairs, ks_pairs_in_SI_units)):
+    for ks_ind, (ks_fit_units, pair_inds, ks_SI_units, (R_for_each_sweep, asc_amp_for_each_sweep, llh_for_each_sweep)) in \
+        enumerate(zip(ks_pairs, ks_pair_inds, ks_pairs_in_SI_units, results)):
         print('ks_fit_units', ks_fit_units)
-        #Create basis IPSPs
+        #Plot basis IPSPs
         if MAKE_PLOT:
             plotting_colors=['r', 'b', 'g', 'm', 'c']
             plt.figure(78, figsize=(20,10))
-        basis_IPSP_list = []
-        for rr in range(len(I_stim)): #loop over repeats
-            #find the basis of the entire trace
-            basis_IPSP, gg0 = GLM.create_basis_IPSP(neye,ncos,taus_filter,ks_fit_units,DTsim,t0_list[rr],I_stim[rr],nkt,flag_exp,npcut)
-            basis_IPSP_list.append(basis_IPSP) 
-            #--Plot basis IPSPs between si and se    
-            si = t0_list[0][0]-10   #plot start_ind
-            se = si+nkt+10  #plot end_ind
-            tvec = dt*np.arange(si-tst,se-tst)   #convert time-steps to real time (in sec)        
-            if MAKE_PLOT:
+            basis_IPSP_list = [basis_IPSP[sweep_offsets[rr]:sweep_offsets[rr+1], pair_inds] for rr in range(len(I_stim))]
+            for rr, basis_IPSP_sweep in enumerate(basis_IPSP_list): #loop over repeats
+                #--Plot basis IPSPs between si and se    
+                si = t0_list[0][0]-10   #plot start_ind
+                se = si+nkt+10  #plot end_ind
+                tvec = dt*np.arange(si-tst,se-tst)   #convert time-steps to real time (in sec)        
                 plt.figure(78)
                 plt.subplot(5,2, ks_ind+1)
-                plt.plot(1e3*tvec,basis_IPSP[si:se,:], lw=2, label=str(rr)) #1e3 plots time on x-axis in ms
+                plt.plot(1e3*tvec,basis_IPSP_sweep[si:se,:], lw=2, label=str(rr)) #1e3 plots time on x-axis in ms
                 plt.xlabel('time (ms)')
                 plt.title("k's "+str(ks_SI_units))
-        if MAKE_PLOT:
             plt.annotate('ASGLM (fit asc and R): AScurrent basis',
                          xy=(.4, .985),
                          xycoords='figure fraction',
@@ -110,79 +381,19 @@ def ASGLM_pairwise(ks_int, I_stim, voltage, spike_ind, cinit, tauinit, SCL, dt,
         if SHOW_PLOT:
             plt.show(block=BLOCK)                                      
         
-        # cut spikes out of dv, v, i, and b_ipsp and put the different sweeps in lists
-        i_all_swps_list = []
-        b_ipsp_all_swps_list = []
-        v_all_swps_list = []
-        dv_all_swps_list = []        
-        for ss in range(len(I_stim)): #loop over repeats
-            tend = len(I_stim[ss])
-            i = I_stim[ss][tst:tend-1]
-            b_ipsp = basis_IPSP_list[ss][tst:tend-1]
-            
-            v = voltage[ss][tst:tend-1]    
-            vs = voltage[ss][tst+1:tend]
-            dv = (vs-v)/dt                  #derivative of voltage
-            
-            #delete npcut points after spike from each qty    
-            delpts = []
-            for kk in range(len(t0_list[ss])):
-                delpts.append(range(int(t0_list[ss][kk])-tst,int(t0_list[ss][kk])-tst+npcut))
-            
-            dv = np.delete(dv,delpts,0)
-            v = np.delete(v,delpts,0)
-            i = np.delete(i,delpts,0)
-            b_ipsp = np.delete(b_ipsp,delpts,0)
-            
-            v_all_swps_list.append(v)
-            dv_all_swps_list.append(dv)
-            i_all_swps_list.append(i)
-            b_ipsp_all_swps_list.append(b_ipsp)
-            
-            tvec = dt*np.arange(len(v))
-        
-        # Compute amplitude each basis AS current using a GLM
         if MAKE_PLOT:
             plt.figure(79, figsize=(20, 12))
             plt.figure(80, figsize=(20, 12))
-        R_for_each_sweep=[]
-        asc_amp_for_each_sweep=[]
-        llh_for_each_sweep=[]
-        for kkk, (v_spike_deleted, dv_spike_deleted, i_spike_deleted, b_ipsp_spikes_deleted) in \
-            enumerate(zip(v_all_swps_list, dv_all_swps_list, i_all_swps_list, b_ipsp_all_swps_list)):
-        
-            #--fitting afterspike current amplitudes and resistance
-            inp = np.zeros((len(i_spike_deleted),ncos+1))
-            inp[:,range(0,ncos)] = (1/cinit)*b_ipsp_spikes_deleted[:,range(ncos)]
-            inp[:,ncos] = -(v_spike_deleted-vL)/tauinit
-            out = dv_spike_deleted -i_spike_deleted/cinit#+ (v-vL)/tauinit - i/cinit
-
-            try:
-                glm_fit = sm.GLM(out,inp,family=sm.families.Gaussian(sm.families.links.identity))
-                res = glm_fit.fit()
-                fitprs = res.params  #fitprs has [AMP OF ASC, TAU]             
-
-                llh=res.llf
-                fit_R=tauinit/(fitprs[ncos]*cinit)
-                fit_asc_amp=fitprs[:ncos]
+            for kkk, (basis_IPSP_sweep, keep, fit_asc_amp, llh) in \
+                enumerate(zip(basis_IPSP_list, keep_list, asc_amp_for_each_sweep, llh_for_each_sweep)):
                 #Compute and plot post-spike current (essentially multiply basis functions with correct amplitudes from GLM fit)
-                ipsc = np.sum(b_ipsp_spikes_deleted[:,0:ncos]*fit_asc_amp,1)  #THIS IS TOTAL POSTSPIKE CURRENT
-            except Exception as e:
-                logging.warning("fit didn't work: " + str(e))
-                llh=np.nan
-                fit_R=np.NAN
-                fit_asc_amp=np.ones(ncos)*np.NAN
-                ipsc=np.ones(len(b_ipsp_spikes_deleted[:,0]))*np.NAN
-                
-            R_for_each_sweep.append(fit_R)
-            asc_amp_for_each_sweep.append(fit_asc_amp)
-            llh_for_each_sweep.append(llh)
-            
-            #Plot a single instance of AS current as function of time (in ms)
-            if MAKE_PLOT:
+                b_ipsp_spikes_deleted = basis_IPSP_sweep[tst:tst+len(keep)][keep]
+                ipsc = b_ipsp_spikes_deleted.dot(fit_asc_amp)  #THIS IS TOTAL POSTSPIKE CURRENT
+
+                #Plot a single instance of AS current as function of time (in ms)
                 plt.figure(79)
                 plt.subplot(5,2, ks_ind+1)
-                plot_inds = np.arange(int(t0_list[0][0])-tst,int(t0_list[0][0])-tst+nkt) #plot just after first spike
+                plot_inds = np.arange(t0_list[0][0]-tst,t0_list[0][0]-tst+nkt) #plot just after first spike
                 tvec = dt*plot_inds
                 plt.plot(tvec,ipsc[plot_inds], lw=2, label='llh='+str(llh))
                 plt.xlabel('time (s)')
@@ -201,7 +412,6 @@ def ASGLM_pairwise(ks_int, I_stim, voltage, spike_ind, cinit, tauinit, SCL, dt,
                 plt.ylabel('current (A)')
                 plt.title("k's "+str(ks_SI_units))
 
-        if MAKE_PLOT:
             plt.figure(79)
             plt.tight_layout()
             plt.annotate('ASGLM (fit asc and R): Sum fit after spike currents',
@@ -230,9 +440,14 @@ def ASGLM_pairwise(ks_int, I_stim, voltage, spike_ind, cinit, tauinit, SCL, dt,
 
         #!!!!!!!!!!!!!we multiplied ks by dt for SI!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!     
     ave_llh_for_each_pair=np.mean(llh_for_all_ks_pairs, axis=1)
-    best_ks_pair_ind = np.where(np.max(ave_llh_for_each_pair)==ave_llh_for_each_pair)[0][0]
+    failed_pairs = np.isnan(ave_llh_for_each_pair)  #pairs whose fit failed have a nan llh
+    if failed_pairs.all():
+        raise Exception('the fits of all ks pairs failed, so there is no best ks pair')
+    if failed_pairs.any():
+        logging.warning("skipping ks pairs whose fit failed: " + str(ks_pairs_in_SI_units[failed_pairs].tolist()))
+    best_ks_pair_ind = int(np.nanargmax(ave_llh_for_each_pair))
 
-    best_k_pair=np.array(ks_pairs[best_ks_pair_ind])/dt
+    best_k_pair=ks_pairs[best_ks_pair_ind]/dt
     best_asc_amp=np.array(asc_amp_for_all_ks_pairs[best_ks_pair_ind])
     best_R=np.array(R_for_all_ks_pairs[best_ks_pair_ind])
     best_llh=np.array(llh_for_all_ks_pairs[best_ks_pair_ind])
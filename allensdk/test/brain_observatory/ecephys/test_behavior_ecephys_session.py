@@ -1,9 +1,14 @@
+import datetime
+import sys
 from pathlib import Path
 
+import h5py
 import pynwb
 import pytest
 import numpy as np
+import pandas as pd
 import copy
+from unittest import mock
 
 from allensdk.brain_observatory.ecephys.behavior_ecephys_session import \
     BehaviorEcephysSession
@@ -99,6 +104,100 @@ def test_read_write_session_with_probe_nwb(
     assert obt == behavior_ecephys_session_with_lfp_fixture
 
 
+def test_probes_table_is_cached():
+    """Tests that the probes table is built once, that callers get a copy
+    of it, and that it is rebuilt after loading LFP"""
+    probe = mock.MagicMock(id=1)
+    probes = mock.MagicMock()
+    probes.__iter__.side_effect = lambda: iter([probe])
+    probes.to_dataframe.side_effect = lambda: pd.DataFrame({'id': [1]})
+
+    session = object.__new__(BehaviorEcephysSession)
+    session._probes = probes
+    session._probes_table = None
+
+    table = session.probes
+    table['id'] = 2
+    assert session.probes['id'].tolist() == [1]
+    assert probes.to_dataframe.call_count == 1
+
+    session.get_lfp(probe_id=1)
+    session.probes
+    assert probes.to_dataframe.call_count == 2
+
+
+@pytest.mark.requires_bamboo
+def test_open_nwb(behavior_ecephys_session_fixture, tmpdir):
+    """Tests reading the session from an nwb file on disk with a tuned
+    chunk cache"""
+    nwbfile, _ = behavior_ecephys_session_fixture.to_nwb()
+
+    path = Path(tmpdir) / 'session.nwb'
+    with pynwb.NWBHDF5IO(path, 'w') as write_io:
+        write_io.write(nwbfile)
+
+    obt = BehaviorEcephysSession.open_nwb(path, chunk_cache_mb=16)
+
+    assert obt == behavior_ecephys_session_fixture
+
+
+@pytest.fixture
+def minimal_nwb_path(tmpdir):
+    nwbfile = pynwb.NWBFile(
+        session_description='test',
+        identifier='1',
+        session_start_time=datetime.datetime.now(datetime.timezone.utc)
+    )
+    path = Path(tmpdir) / 'session.nwb'
+    with pynwb.NWBHDF5IO(path, 'w') as write_io:
+        write_io.write(nwbfile)
+    return path
+
+
+def test_open_nwb_from_path(minimal_nwb_path):
+    """Tests reading a local nwb file with the requested chunk cache"""
+    with mock.patch.object(h5py, 'File', wraps=h5py.File) as h5_file, \
+            mock.patch.object(BehaviorEcephysSession, 'from_nwb') as from_nwb:
+        obt = BehaviorEcephysSession.open_nwb(
+            minimal_nwb_path, chunk_cache_mb=16)
+
+    h5_file.assert_called_once_with(
+        str(minimal_nwb_path), 'r', rdcc_nbytes=16 * 1024**2,
+        rdcc_nslots=50000, rdcc_w0=0.5)
+    assert obt is from_nwb.return_value
+    assert from_nwb.call_args.kwargs['nwbfile'].identifier == '1'
+
+
+def test_open_nwb_from_url(minimal_nwb_path):
+    """Tests that a URL is streamed through remfile and that the remote file
+    is closed after reading"""
+    handles = []
+
+    def remote_file(url):
+        handles.append(open(minimal_nwb_path, 'rb'))
+        return handles[-1]
+
+    remfile = mock.MagicMock()
+    remfile.File.side_effect = remote_file
+    url = 'https://example.org/session.nwb'
+    with mock.patch.dict(sys.modules, {'remfile': remfile}), \
+            mock.patch.object(BehaviorEcephysSession, 'from_nwb') as from_nwb:
+        obt = BehaviorEcephysSession.open_nwb(url)
+
+    remfile.File.assert_called_once_with(url)
+    assert obt is from_nwb.return_value
+    assert from_nwb.call_args.kwargs['nwbfile'].identifier == '1'
+    assert handles[0].closed
+
+
+def test_open_nwb_from_url_without_remfile():
+    """Tests that opening a URL without remfile installed says so"""
+    with mock.patch.dict(sys.modules, {'remfile': None}):
+        with pytest.raises(ModuleNotFoundError,
+                           match='remfile must be installed'):
+            BehaviorEcephysSession.open_nwb('https://example.org/session.nwb')
+
+
 @pytest.mark.requires_bamboo
 def test_session_consistency(
         behavior_ecephys_session_fixture):
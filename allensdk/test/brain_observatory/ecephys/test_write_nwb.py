@@ -531,7 +531,17 @@ def test_add_ecephys_electrodes(
             ["a", "b"],
             [3, 6],
             [1, 2, 3, 4, 5, 6],
-        ]
+        ],
+        [
+            {
+                "a": np.array([1.5, 2.5]),
+                "b": np.array([]),
+                "c": np.array([3.5]),
+            },
+            ["c", "a", "b"],
+            [1, 3, 3],
+            [3.5, 1.5, 2.5],
+        ],
     ],
 )
 def test_dict_to_indexed_array(dc, order, exp_idx, exp_data):
@@ -540,6 +550,18 @@ def test_dict_to_indexed_array(dc, order, exp_idx, exp_data):
     assert np.allclose(exp_data, obt_data)
 
 
+def test_dict_to_indexed_array_keeps_array_dtype():
+    # ndarray values are concatenated as is rather than element by element,
+    # so an empty array no longer promotes float32 data to float64
+    dc = {
+        "a": np.array([1.5, 2.5], dtype=np.float32),
+        "b": np.array([], dtype=np.float32),
+    }
+    obt_idx, obt_data = dict_to_indexed_array(dc, ["a", "b"])
+    assert obt_idx == [2, 2]
+    assert obt_data.dtype == np.float32
+
+
 def test_add_ragged_data_to_dynamic_table(units_table, spike_times):
     allensdk.brain_observatory.ecephys.nwb_util.add_ragged_data_to_dynamic_table(  # noqa: E501
         table=units_table, data=spike_times, column_name="spike_times"
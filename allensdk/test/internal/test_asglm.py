@@ -0,0 +1,231 @@
+import pytest
+from unittest import mock
+import numpy as np
+from allensdk.internal.model.glif import ASGLM
+
+
+@pytest.fixture
+def sweep():
+    rng = np.random.default_rng(0)
+    n_t = 400
+    basis_IPSP = rng.normal(size=(n_t + 50, 5))
+    keep = np.ones(n_t, dtype=bool)
+    for spike in [40, 180, 310]:
+        keep[spike:spike + 20] = False
+    v_spike_deleted = rng.normal(-0.07, 0.005, size=keep.sum())
+    out = rng.normal(size=keep.sum())
+    return basis_IPSP, keep, v_spike_deleted, out
+
+
+def test_sweep_normal_equations_loop_matches_numpy(sweep):
+    basis_IPSP, keep, v_spike_deleted, out = sweep
+    args = (basis_IPSP, 50, np.array([1, 3]), keep, v_spike_deleted, out,
+            2, 1.0 / 2e-10, 1.0 / 0.01, -0.07)
+
+    expected = ASGLM._sweep_normal_equations_numpy(*args)
+    obtained = ASGLM._sweep_normal_equations_loop(*args)
+
+    np.testing.assert_allclose(obtained[0], expected[0], rtol=1e-10)
+    np.testing.assert_allclose(obtained[1], expected[1], rtol=1e-10)
+    assert obtained[2] == expected[2] == keep.sum()
+
+
+def test_sweep_normal_equations_numba_matches_numpy(sweep):
+    pytest.importorskip("numba")
+    basis_IPSP, keep, v_spike_deleted, out = sweep
+    args = (basis_IPSP, 50, np.array([1, 3]), keep, v_spike_deleted, out,
+            2, 1.0 / 2e-10, 1.0 / 0.01, -0.07)
+
+    expected = ASGLM._sweep_normal_equations_numpy(*args)
+    obtained = ASGLM._sweep_normal_equations(*args)
+
+    np.testing.assert_allclose(obtained[0], expected[0], rtol=1e-10)
+    np.testing.assert_allclose(obtained[1], expected[1], rtol=1e-10)
+    assert obtained[2] == expected[2] == keep.sum()
+
+
+def test_sweep_rss_loop_matches_numpy(sweep):
+    basis_IPSP, keep, v_spike_deleted, out = sweep
+    args = (basis_IPSP, 50, np.array([1, 3]), keep, v_spike_deleted, out,
+            2, 1.0 / 2e-10, 1.0 / 0.01, -0.07, np.array([1e-10, -2e-10, 3.]))
+
+    expected = ASGLM._sweep_rss_numpy(*args)
+
+    assert ASGLM._sweep_rss_loop(*args) == pytest.approx(expected, rel=1e-10)
+    assert ASGLM._sweep_rss(*args) == pytest.approx(expected, rel=1e-10)
+
+
+def simulate_sweeps(noise):
+    # leaky integrator driven by a noisy step current, with exponentially
+    # decaying currents injected after each spike
+    rng = np.random.default_rng(1)
+    dt, cinit, tauinit, vL = 5e-5, 1e-10, 0.01, -0.07
+    I_stim, voltage, spike_ind = [], [], []
+    for spikes in [[500, 2100, 3600], [800, 2500, 4000]]:
+        n_t = 5000
+        i = 2e-10 + 2e-11 * rng.normal(size=n_t)
+        t = np.arange(n_t) * dt
+        asc = np.zeros(n_t)
+        for spike in spikes:
+            after = t[spike:] - t[spike]
+            asc[spike:] += (-5e-11 * np.exp(-30 * after) +
+                            2e-11 * np.exp(-300 * after))
+        v = np.empty(n_t)
+        v[0] = vL
+        for tt in range(n_t - 1):
+            dv = (vL - v[tt]) / tauinit + (i[tt] + asc[tt]) / cinit
+            v[tt + 1] = v[tt] + dt * dv
+        v += noise * rng.normal(size=n_t)
+        I_stim.append(i)
+        voltage.append(v)
+        spike_ind.append(np.array(spikes))
+    return dict(ks_int=[3., 10., 30., 100., 300.], I_stim=I_stim,
+                voltage=voltage, spike_ind=spike_ind, cinit=cinit,
+                tauinit=tauinit, SCL=20, dt=dt, resting_potential=vL)
+
+
+@pytest.fixture
+def sweeps():
+    return simulate_sweeps(noise=1e-5)
+
+
+def test_ASGLM_pairwise_low_noise():
+    # with almost no noise the residuals are tiny, so they have to be summed
+    # directly rather than derived from the normal equations
+    best_k_pair, best_asc_amp, best_R, best_llh = ASGLM.ASGLM_pairwise(
+        n_jobs=1, **simulate_sweeps(noise=1e-12))
+
+    np.testing.assert_allclose(best_k_pair, [30., 300.])
+    assert np.all(np.isfinite(best_llh))
+    np.testing.assert_allclose(best_asc_amp, [[-5e-11, 2e-11]] * 2, rtol=0.05)
+
+
+def test_ASGLM_pairwise_parallel_matches_serial(sweeps):
+    pytest.importorskip("joblib")
+    serial = ASGLM.ASGLM_pairwise(n_jobs=1, **sweeps)
+    parallel = ASGLM.ASGLM_pairwise(n_jobs=2, **sweeps)
+
+    for obtained, expected in zip(parallel, serial):
+        np.testing.assert_allclose(obtained, expected, rtol=1e-12)
+
+
+def test_fit_ks_pair_joint_matches_lstsq(sweep):
+    basis_IPSP, keep, v_spike_deleted, out = sweep
+    cinit, tauinit, vL = 2e-10, 0.01, -0.07
+    pair_inds = np.array([0, 2])
+    # two sweeps stored back to back in basis_IPSP, cut differently
+    n_t = len(keep)
+    keep_list = [keep, np.roll(keep, 25)]
+    v_list = [v_spike_deleted, v_spike_deleted[::-1][:keep_list[1].sum()]]
+    out_list = [out, 0.5 * out[:keep_list[1].sum()]]
+    basis_IPSP = np.vstack([basis_IPSP[:n_t], basis_IPSP[-n_t:]])
+    sweep_offsets = np.array([0, n_t, 2 * n_t])
+
+    R, asc_amp, llh = ASGLM._fit_ks_pair(
+        basis_IPSP, sweep_offsets, pair_inds, keep_list, v_list, out_list,
+        0, 2, cinit, tauinit, vL, joint=True)
+
+    X = np.vstack([
+        np.column_stack([
+            basis_IPSP[offset:offset + n_t][np.ix_(k, pair_inds)] / cinit,
+            (vL - v) / tauinit])
+        for offset, k, v in zip(sweep_offsets, keep_list, v_list)])
+    y = np.concatenate(out_list)
+    fitprs, rss, _, _ = np.linalg.lstsq(X, y, rcond=None)
+    expected_llh = -0.5 * len(y) * (np.log(2 * np.pi * rss[0] / len(y)) + 1)
+
+    assert len(R) == len(asc_amp) == len(llh) == 1
+    np.testing.assert_allclose(asc_amp[0], fitprs[:2], rtol=1e-8)
+    assert R[0] == pytest.approx(tauinit / (fitprs[2] * cinit), rel=1e-8)
+    assert llh[0] == pytest.approx(expected_llh, rel=1e-8)
+
+
+def test_ASGLM_pairwise_joint_returns_single_fit(sweeps):
+    best_k_pair, best_asc_amp, best_R, best_llh = ASGLM.ASGLM_pairwise(
+        n_jobs=1, joint=True, **sweeps)
+
+    np.testing.assert_allclose(best_k_pair, [30., 300.])
+    assert len(best_asc_amp) == len(best_R) == len(best_llh) == 1
+    np.testing.assert_allclose(best_asc_amp[0], [-5e-11, 2e-11], rtol=0.05)
+
+
+def test_ASGLM_pairwise_skips_failed_pairs(sweeps, monkeypatch, caplog):
+    fit_ks_pair = ASGLM._fit_ks_pair
+
+    def fail_with_k_300(basis_IPSP, sweep_offsets, pair_inds, *args):
+        fits = fit_ks_pair(basis_IPSP, sweep_offsets, pair_inds, *args)
+        if 4 in pair_inds:
+            fits[2][0] = np.nan
+        return fits
+
+    monkeypatch.setattr(ASGLM, "_fit_ks_pair", fail_with_k_300)
+    best_k_pair, _, _, _ = ASGLM.ASGLM_pairwise(n_jobs=1, **sweeps)
+
+    assert 300. not in best_k_pair
+    assert "skipping ks pairs whose fit failed" in caplog.text
+    assert "[30.0, 300.0]" in caplog.text
+
+
+def test_ASGLM_pairwise_all_fits_failed(sweeps, monkeypatch):
+    monkeypatch.setattr(np.linalg, "solve", mock.Mock(
+        side_effect=np.linalg.LinAlgError("Singular matrix")))
+
+    with pytest.raises(Exception, match="fits of all ks pairs failed"):
+        ASGLM.ASGLM_pairwise(n_jobs=1, **sweeps)
+
+
+@pytest.mark.parametrize("noise", [1e-3, 1e-6])
+def test_fit_ks_pair_matches_statsmodels(sweep, noise):
+    sm = pytest.importorskip("statsmodels.api")
+    basis_IPSP, keep, v_spike_deleted, _ = sweep
+    cinit, tauinit, vL = 2e-10, 0.01, -0.07
+    pair_inds = np.array([1, 3])
+    X = np.column_stack([
+        basis_IPSP[50:50 + len(keep)][np.ix_(keep, pair_inds)] / cinit,
+        (vL - v_spike_deleted) / tauinit])
+    rng = np.random.default_rng(2)
+    out = X.dot([-5e-11, 2e-11, 1.]) + noise * rng.normal(size=len(X))
+
+    R, asc_amp, llh = ASGLM._fit_ks_pair(
+        basis_IPSP, np.array([50]), pair_inds, [keep], [v_spike_deleted],
+        [out], 0, 2, cinit, tauinit, vL)
+
+    family = sm.families.Gaussian(sm.families.links.identity())
+    expected = sm.GLM(out, X, family=family).fit()
+    np.testing.assert_allclose(asc_amp[0], expected.params[:2], rtol=1e-8)
+    assert R[0] == pytest.approx(
+        tauinit / (expected.params[2] * cinit), rel=1e-8)
+    assert llh[0] == pytest.approx(expected.llf, rel=1e-8)
+
+
+@pytest.mark.parametrize("t0", [
+    np.array([10, 30, 35, 70]),  # overlapping windows
+    np.array([10, 85]),  # window running past the end of the sweep
+])
+def test_post_spike_keep_mask_matches_np_delete(t0):
+    n_t, npcut = 100, 20
+    delpts = [range(t, t + npcut) for t in t0]
+    if t0.max() + npcut > n_t:
+        # np.delete raised on the indices past the end of the sweep, the mask
+        # now drops only the points that are in the sweep
+        with pytest.raises(IndexError):
+            np.delete(np.arange(n_t), delpts)
+        delpts = [range(t, min(t + npcut, n_t)) for t in t0]
+    expected = np.delete(np.arange(n_t), np.concatenate(delpts))
+
+    keep = ASGLM._post_spike_keep_mask(n_t, t0, npcut)
+
+    np.testing.assert_array_equal(np.arange(n_t)[keep], expected)
+
+
+def test_ASGLM_pairwise_selects_spikes_in_sweep(sweeps):
+    expected = ASGLM.ASGLM_pairwise(n_jobs=1, **sweeps)
+
+    # unsorted spike indices with spikes at and past the ends of the sweeps,
+    # which are not in (tst, tend) and are dropped
+    sweeps["spike_ind"] = [np.concatenate([[5000, 0], s[::-1], [7000]])
+                           for s in sweeps["spike_ind"]]
+    obtained = ASGLM.ASGLM_pairwise(n_jobs=1, **sweeps)
+
+    for o, e in zip(obtained, expected):
+        np.testing.assert_array_equal(o, e)